@@ -1,428 +1,661 @@
 # Carter Humphreys
 # https://github.com/HumphreysCarter/weewx-fastapi
 
-import json
+import os
 import math
+import time
+import hashlib
+import orjson
+import queue
+import asyncio
+import calendar
+import itertools
+import logging
 import sqlite3
+import threading
 import weewx.units
+from enum import StrEnum
+from collections import OrderedDict
 from pathlib import Path
+from functools import lru_cache
+from contextlib import closing, contextmanager
 from statistics import mean
-from datetime import datetime
-from fastapi import APIRouter, HTTPException, Query
+from datetime import datetime, timezone
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+log = logging.getLogger(__name__)
+
+# Number of read-only connections kept open for each database. SQLite releases the GIL while it runs a query,
+# so queries offloaded to threads read in parallel on as many connections as there are cores
+DB_POOL_SIZE = min(8, max(4, os.cpu_count() or 1))
+
+# KiB of page cache shared by the pooled connections of a database, split evenly so a larger pool doesn't
+# use more memory
+DB_CACHE_KIB = 262144
+
+# Seconds a query waits for WeeWX to release its write lock before failing
+DB_BUSY_TIMEOUT = 5
+
+# Number of prepared statements kept by each pooled connection
+DB_STATEMENT_CACHE_SIZE = 256
+
+# Seconds a request waits for a free pooled connection before failing
+DB_POOL_TIMEOUT = 10
+
+# Number of rows fetched at a time when streaming data from the database
+DB_FETCH_SIZE = 10000
+
+# Row layout used when reading archive data into NumPy
+DB_ROW_DTYPE = np.dtype([('dateTime', np.int64), ('value', np.float64)]) if np is not None else None
+
+# Seconds clients may reuse responses that don't change while the server is running
+STATIC_MAX_AGE = 3600
+
+# Number of historical responses kept in each response cache
+RESPONSE_CACHE_SIZE = 128
+
+# Total bytes of serialized responses kept in each response cache, and the largest response that is cached
+RESPONSE_CACHE_BYTES = 16 * 1024 * 1024
+RESPONSE_CACHE_MAX_ITEM_BYTES = 1024 * 1024
+
+# WHERE clauses keyed by (bounds given: 1 = start, 2 = end, 3 = both; whether the single bound is inclusive)
+WHERE_CLAUSES = {
+    (0, True): '',
+    (0, False): '',
+    (1, True): 'WHERE dateTime >= ?',
+    (1, False): 'WHERE dateTime > ?',
+    (2, True): 'WHERE dateTime <= ?',
+    (2, False): 'WHERE dateTime < ?',
+    (3, True): 'WHERE dateTime BETWEEN ? AND ?',
+    (3, False): 'WHERE dateTime BETWEEN ? AND ?',
+}
+
+_db_pools = {}
+_db_pools_lock = threading.Lock()
+
+
+class ResponseCache:
+    # Least recently used cache of serialized responses, bounded by total size as well as entry count so
+    # clients requesting many large ranges can't grow the server's memory without limit
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, max_bytes=RESPONSE_CACHE_BYTES,
+                 max_item_bytes=RESPONSE_CACHE_MAX_ITEM_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get_or_create(self, key, create):
+        with self._lock:
+            content = self._entries.get(key)
+            if content is not None:
+                self._entries.move_to_end(key)
+                return content
+
+        content = create()
+
+        # Large responses are returned without being cached
+        if len(content) <= self.max_item_bytes:
+            with self._lock:
+                if key not in self._entries:
+                    self._entries[key] = content
+                    self._size += len(content)
+                    while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                        _, evicted = self._entries.popitem(last=False)
+                        self._size -= len(evicted)
+
+        return content
+
+
+class MonthName(StrEnum):
+    # Month names accepted as query parameters, validated with a lookup instead of a regex
+    January = 'January'
+    February = 'February'
+    March = 'March'
+    April = 'April'
+    May = 'May'
+    June = 'June'
+    July = 'July'
+    August = 'August'
+    September = 'September'
+    October = 'October'
+    November = 'November'
+    December = 'December'
+
+    @classmethod
+    def _missing_(cls, value):
+        # Match month names regardless of case
+        if isinstance(value, str):
+            return cls.__members__.get(value.capitalize())
+        return None
 
-# Create regex for month validation
-VALID_MONTHS = 'January|February|March|April|May|June|July|August|September|October|November|December'
-REGEX_PATTERN = rf'(?i)^({VALID_MONTHS})$'
 
+class DataFormat(StrEnum):
+    # Encodings available for streamed archive data
+    json = 'json'
+    ndjson = 'ndjson'
 
-def load_prism_normals(path_to_json):
+
+# Month numbers keyed by month name, and month names in calendar order
+MONTH_NUMBERS = {month: number for number, month in enumerate(MonthName, start=1)}
+MONTH_NAMES = tuple(MonthName)
+
+
+@lru_cache(maxsize=4)
+def read_prism_normals(path_to_json, mtime_ns):
+    # Parse each version of a normals file once, mtime_ns is only part of the cache key
     try:
-        with open(path_to_json, 'r') as file:
-            prism_normals = json.load(file)
+        with open(path_to_json, 'rb') as file:
+            prism_normals = orjson.loads(file.read())
     except FileNotFoundError:
         return None
 
     return prism_normals
 
 
+def load_prism_normals(path_to_json):
+    # Routers built again in the same process share the loaded normals, unless the file was downloaded again
+    try:
+        mtime_ns = Path(path_to_json).stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    return read_prism_normals(path_to_json, mtime_ns)
+
+
+@lru_cache(maxsize=4096)
+def parse_yyyymmddhhmm(value):
+    # Convert a YYYYMMDDHHMM query value to a timestamp, splitting the digits with divmod is much cheaper than strptime
+    value, minute = divmod(int(value), 100)
+    value, hour = divmod(value, 100)
+    value, day = divmod(value, 100)
+    year, month = divmod(value, 100)
+    dt = datetime(year, month, day, hour, minute)
+
+    return int(dt.timestamp())
+
+
+def parse_time_param(value):
+    # Convert an optional start/end query value, rejecting impossible dates with a 400 instead of a server error
+    if value is None:
+        return None
+
+    try:
+        return parse_yyyymmddhhmm(value)
+    except (ValueError, OverflowError, OSError):
+        raise HTTPException(status_code=400, detail=f'Invalid time: {value}, expected YYYYMMDDHHMM')
+
+
+def is_real_type(column_type):
+    # SQLite's column affinity rules, only REAL columns can be read into float64 arrays without changing the values
+    column_type = (column_type or '').upper()
+    return 'INT' not in column_type and any(name in column_type for name in ('REAL', 'FLOA', 'DOUB'))
+
+
+def json_response(content):
+    # Return JSON that was already serialized with orjson
+    return Response(content=content, media_type='application/json')
+
+
+@lru_cache(maxsize=512)
+def get_etag(content):
+    # Hash each static response once, the same bytes are returned on every request
+    return '"' + hashlib.blake2b(content, digest_size=8).hexdigest() + '"'
+
+
+def static_json_response(content, request):
+    # Let clients cache static responses and revalidate them, answering 304 when their copy is current
+    etag = get_etag(content)
+    headers = {'ETag': etag, 'Cache-Control': f'public, max-age={STATIC_MAX_AGE}'}
+    if etag in request.headers.get('if-none-match', ''):
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=content, media_type='application/json', headers=headers)
+
+
+def stream_json_array(row_chunks):
+    # Encode each chunk of rows as a slice of one JSON array
+    prefix = b'['
+    for rows in row_chunks:
+        yield prefix + orjson.dumps(rows)[1:-1]
+        prefix = b','
+
+    yield b']' if prefix == b',' else b'[]'
+
+
+def stream_ndjson(row_chunks):
+    # Encode each row as its own JSON line, so clients can parse the data as it arrives
+    for rows in row_chunks:
+        yield b'\n'.join(map(orjson.dumps, rows)) + b'\n'
+
+
 def build_where_clause(ts_start=None, ts_end=None, start_inclusive=True, end_inclusive=True):
-    if start_inclusive:
-        start_clause = '>='
-    else:
-        start_clause = '>'
-    if end_inclusive:
-        end_clause = '<='
-    else:
-        end_clause = '<'
+    # Pick the precomputed clause for the bounds that are given, timestamps are bound as parameters
+    bounds = (ts_start is not None) | (ts_end is not None) << 1
+    inclusive = end_inclusive if bounds == 2 else start_inclusive
+    params = tuple(ts for ts in (ts_start, ts_end) if ts is not None)
+
+    return WHERE_CLAUSES[bounds, inclusive], params
+
+
+def get_utc_ranges(first_year, last_year, month=None, day=None):
+    # Epoch ranges of a year, month or day (UTC) for every year in the period, days missing from a year are skipped
+    ranges = []
+    for year in range(first_year, last_year + 1):
+        if month is None:
+            start, end = (year, 1, 1), (year + 1, 1, 1)
+        elif day is None:
+            start, end = (year, month, 1), (year + month // 12, month % 12 + 1, 1)
+        elif day <= calendar.monthrange(year, month)[1]:
+            start, end = (year, month, day), None
+        else:
+            continue
 
-    if ts_start and ts_end:
-        return f'WHERE dateTime BETWEEN {ts_start} AND {ts_end}'
-    elif ts_start:
-        return f'WHERE dateTime {start_clause} {ts_start}'
-    elif ts_end:
-        return f'WHERE dateTime {end_clause} {ts_end}'
+        start = calendar.timegm(start + (0, 0, 0))
+        end = calendar.timegm(end + (0, 0, 0)) if end is not None else start + 86400
+        ranges.append((start, end))
 
-    return ''
+    return ranges
 
 
-def get_db_connection(db_path):
-    connection = sqlite3.connect(db_path)
+@lru_cache(maxsize=64)
+def build_ranges_sql(num_ranges):
+    return 'WHERE ' + ' OR '.join(['(dateTime >= ? AND dateTime < ?)'] * num_ranges)
+
+
+def build_range_where_clause(ranges):
+    # Range predicates on dateTime let SQLite search the primary key instead of calling strftime on every row
+    if not ranges:
+        return 'WHERE 0', ()
+
+    where_clause = build_ranges_sql(len(ranges))
+    params = tuple(ts for r in ranges for ts in r)
+
+    return where_clause, params
+
+
+def open_db_connection(db_path):
+    # Open the database read-only, the connection is handed between server threads by the pool.
+    # immutable=1 and nolock=1 are not used, WeeWX keeps appending records while the server reads
+    db_uri = Path(db_path).resolve().as_uri() + '?mode=ro'
+    connection = sqlite3.connect(db_uri, uri=True, timeout=DB_BUSY_TIMEOUT, check_same_thread=False,
+                                 cached_statements=DB_STATEMENT_CACHE_SIZE)
+
+    # Keep temp tables in memory, read pages through a memory map and give each connection its share of the page cache
+    connection.execute('PRAGMA temp_store=MEMORY')
+    connection.execute('PRAGMA mmap_size=268435456')
+    connection.execute(f'PRAGMA cache_size=-{DB_CACHE_KIB // DB_POOL_SIZE}')
+    connection.execute('PRAGMA query_only=1')
+
     return connection
 
 
-def get_db_columns(db_path):
+def get_db_pool(db_path):
+    key = str(db_path)
+    with _db_pools_lock:
+        pool = _db_pools.get(key)
+        if pool is None:
+            pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+            for _ in range(DB_POOL_SIZE):
+                pool.put(open_db_connection(db_path))
+            _db_pools[key] = pool
+
+    return pool
+
+
+@contextmanager
+def get_db_connection(db_path):
+    # Borrow a connection from the pool and return it when done, so the page cache stays warm between requests
+    pool = get_db_pool(db_path)
+    try:
+        connection = pool.get(timeout=DB_POOL_TIMEOUT)
+    except queue.Empty:
+        raise HTTPException(status_code=503, detail='Database is busy, try again later')
+    try:
+        yield connection
+    finally:
+        pool.put(connection)
+
+
+def close_db_connections():
+    with _db_pools_lock:
+        for pool in _db_pools.values():
+            while not pool.empty():
+                pool.get_nowait().close()
+        _db_pools.clear()
+
+
+def enable_db_wal(db_path):
+    # WAL lets the API read while WeeWX writes, the journal mode is stored in the database file
+    try:
+        with sqlite3.connect(db_path, timeout=10) as conn:
+            journal_mode = conn.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+    except sqlite3.Error as e:
+        log.warning(f'DataAPI: failed to enable WAL journal mode: {e}')
+        return
+
+    log.info(f'DataAPI: database journal mode is {journal_mode}')
+
+
+def create_db_indexes(db_path, obs_types):
+    # Covering indexes let range queries for these obs types read the index instead of the full archive rows
+    try:
+        with sqlite3.connect(db_path, timeout=10) as conn:
+            for obs_type in obs_types:
+                conn.execute(f'CREATE INDEX IF NOT EXISTS idx_archive_dateTime_{obs_type} ON archive(dateTime, {obs_type})')
+    except sqlite3.Error as e:
+        log.warning(f'DataAPI: failed to create archive indexes: {e}')
+        return
+
+    log.info(f'DataAPI: archive indexes available for {", ".join(obs_types)}')
+
+
+def get_db_info(db_path):
+    # Read what the router needs at startup on a read-write connection, without creating a missing database.
+    # WeeWX may have been interrupted mid-write and left a hot journal behind, which only a connection that can
+    # write is able to roll back
+    info = {'first_record': None, 'columns': [], 'summary_types': [], 'journal_mode': None}
+    try:
+        db_uri = Path(db_path).resolve().as_uri() + '?mode=rw'
+        with closing(sqlite3.connect(db_uri, uri=True, timeout=10)) as conn:
+            info['first_record'] = conn.execute('SELECT MIN(dateTime) FROM archive').fetchone()[0]
+
+            # Keep just the (name, type) of each column
+            info['columns'] = [(column[1], column[2]) for column in conn.execute('PRAGMA table_info(archive)')]
+
+            # Obs types with a daily summary table, archive_day__metadata holds the summary settings
+            tables = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'archive_day_%'")
+            info['summary_types'] = [name[len('archive_day_'):] for name, in tables
+                                     if not name.startswith('archive_day__')]
+
+            # WeeWX or another tool may have set the journal mode, so read it rather than trusting the config
+            info['journal_mode'] = conn.execute('PRAGMA journal_mode').fetchone()[0].lower()
+    except sqlite3.Error as e:
+        # Don't stop WeeWX from starting, the API serves what it can
+        log.error(f'DataAPI: failed to read the database: {e}')
+
+    return info
+
+
+def get_db_latest(db_path, var):
+    # Newest archive record for an obs type, read from the end of the primary key
     with get_db_connection(db_path) as conn:
         cur = conn.cursor()
-        cur.execute('PRAGMA table_info(archive)')
-        db_columns = cur.fetchall()
+        cur.execute(f'SELECT dateTime,{var} FROM archive ORDER BY dateTime DESC LIMIT 1')
+
+        return cur.fetchone()
 
-    db_columns = [{'name': column[1], 'type': column[2]} for column in db_columns]
 
-    return db_columns
+def iter_db_rows(cur, size=DB_FETCH_SIZE):
+    while rows := cur.fetchmany(size):
+        yield rows
 
 
-def get_db_data(db_path, var, ts_start=None, ts_end=None, latest=False):
+def iter_db_data(db_path, var, ts_start=None, ts_end=None):
+    # Only for WAL mode, where readers don't block WeeWX, the connection is held until the last batch is sent
     with get_db_connection(db_path) as conn:
         cur = conn.cursor()
-        if latest:
-            cur.execute(f'SELECT dateTime,{var} FROM archive ORDER BY dateTime DESC LIMIT 1')
-        else:
-            where_clause = build_where_clause(ts_start, ts_end)
-            cur.execute(f'SELECT dateTime,{var} FROM archive {where_clause}')
+        where_clause, params = build_where_clause(ts_start, ts_end)
+        cur.execute(f'SELECT dateTime,{var} FROM archive {where_clause}', params)
 
-        return cur.fetchall()
+        yield from iter_db_rows(cur)
 
 
-def get_var_stats(db_path, var, ts_start=None, ts_end=None):
-    # Build the where clause
-    where_clause = build_where_clause(ts_start, ts_end)
+def get_db_data_batches(db_path, var, ts_start=None, ts_end=None):
+    # In rollback journal mode an open statement holds a shared lock that stops WeeWX saving records, so every
+    # batch is read before the connection goes back to the pool. The whole range is held in memory and only the
+    # encoding is streamed to the client
+    with get_db_connection(db_path) as conn:
+        cur = conn.cursor()
+        where_clause, params = build_where_clause(ts_start, ts_end)
+        cur.execute(f'SELECT dateTime,{var} FROM archive {where_clause}', params)
+
+        return list(iter_db_rows(cur))
+
+
+def get_db_data_columns(db_path, variables, ts_start=None, ts_end=None, column_types=None):
+    # Read several obs types in one query and return them column-oriented, so timestamps are listed once
+    data = {name: [] for name in ('dateTime', *variables)}
+    series = list(data.values())
 
     with get_db_connection(db_path) as conn:
         cur = conn.cursor()
+        where_clause, params = build_where_clause(ts_start, ts_end)
+        cur.execute(f'SELECT {",".join(data)} FROM archive {where_clause}', params)
 
-        cur.execute(f'SELECT MIN({var}), MAX({var}), AVG({var}), SUM({var}), COUNT({var}) FROM archive {where_clause}')
-        min, max, svg, sum, count = cur.fetchone()
+        if np is not None and column_types is not None and all(is_real_type(column_types[var]) for var in variables):
+            # Read the rows straight into arrays, orjson then encodes each column without building Python objects
+            dtype = np.dtype([('dateTime', np.int64)] + [(var, np.float64) for var in variables])
+            rows = np.fromiter(cur, dtype=dtype)
+            return {name: np.ascontiguousarray(rows[name]) for name in data}
 
-        return {'min': min, 'max': max, 'avg': svg, 'sum': sum, 'count': count}
+        for rows in iter_db_rows(cur):
+            for values, column in zip(series, zip(*rows)):
+                values.extend(column)
 
+    return data
 
-def get_var_daily_record(db_path, obs_type, month_name, day, func='max'):
-    func = func.lower()
-    if func not in {'max', 'min', 'sum'}:
-        raise ValueError("func must be one of {'max','min','sum'}")
 
-    if func == 'max':
-        value_col, time_col, agg = 'max', 'maxTime', 'MAX'
-    elif func == 'min':
-        value_col, time_col, agg = 'min', 'minTime', 'MIN'
-    else:  # func == 'sum'
-        value_col, time_col, agg = 'sum', 'dateTime', 'MAX'
+def get_db_last_update(db_path):
+    # Time of the newest archive record, read from the end of the primary key
+    with get_db_connection(db_path) as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT MAX(dateTime) FROM archive')
 
-    # Parse month name → 'MM'
-    try:
-        mm = f"{datetime.strptime(month_name.strip(), '%B').month:02d}"
-    except ValueError:
-        raise ValueError('month_name must be a full month name')
+        return cur.fetchone()[0]
 
-    dd = f'{int(day):02d}'
-    table = f'archive_day_{obs_type}'
 
-    sql = f"""
-    WITH mx AS (
-      SELECT {agg}({value_col}) AS target_val
-      FROM {table}
-      WHERE strftime('%m', dateTime, 'unixepoch') = :mm
-        AND strftime('%d', dateTime, 'unixepoch') = :dd
-    )
-    SELECT t.{value_col} AS val,
-           GROUP_CONCAT(datetime(t.{time_col}, 'unixepoch')) AS times
-    FROM {table} AS t
-    JOIN mx ON t.{value_col} = mx.target_val
-    WHERE strftime('%m', t.dateTime, 'unixepoch') = :mm
-      AND strftime('%d', t.dateTime, 'unixepoch') = :dd
-    GROUP BY t.{value_col};
-    """
+def get_var_stats(db_path, var, ts_start=None, ts_end=None):
+    # Build the where clause
+    where_clause, params = build_where_clause(ts_start, ts_end)
 
     with get_db_connection(db_path) as conn:
         cur = conn.cursor()
-        cur.execute(sql, {'mm': mm, 'dd': dd})
-        row = cur.fetchone()
 
-    if not row:
-        return None
+        cur.execute(f'SELECT MIN({var}), MAX({var}), AVG({var}), SUM({var}), COUNT({var}) FROM archive {where_clause}',
+                    params)
+        min, max, svg, sum, count = cur.fetchone()
 
-    value = row[0]
-    times = row[1].split(',') if row[1] else []
-    times = [datetime.strptime(dt, '%Y-%m-%d %H:%M:%S').isoformat() + 'Z' for dt in times]
-    times.sort()
-    return value, times
+        return {'min': min, 'max': max, 'avg': svg, 'sum': sum, 'count': count}
 
 
-def get_var_monthly_record(db_path, obs_type, month_name, func='max'):
-    func = func.lower()
-    if func not in {'max', 'min', 'sum'}:
-        raise ValueError("func must be one of {'max','min','sum'}")
+def parse_db_times(times):
+    # Split a GROUP_CONCAT of ISO 8601 times formatted by SQLite, they sort chronologically as strings
+    if not times:
+        return []
 
-    if func == 'max':
-        value_col, time_col, agg = 'max', 'maxTime', 'MAX'
-    elif func == 'min':
-        value_col, time_col, agg = 'min', 'minTime', 'MIN'
-    else:  # sum
-        value_col, time_col, agg = 'sum', 'dateTime', 'MAX'
+    return sorted(times.split(','))
 
-    try:
-        mm = f"{datetime.strptime(month_name.strip(), '%B').month:02d}"
-    except ValueError:
-        raise ValueError('month_name must be a full month name')
 
+@lru_cache(maxsize=256)
+def build_records_sql(obs_type, where_clause='', by_year=False):
+    # Build each records statement once, so the same SQL string is passed to SQLite and its statement cache is hit
     table = f'archive_day_{obs_type}'
 
+    # Compute the max, min and sum records with their tied times in one statement over the filtered rows
+    year_sql = ''
+    year_cols = ''
+    if by_year:
+        year_sql = """,
+    per_year AS (
+      SELECT strftime('%Y', dateTime, 'unixepoch') AS yr, SUM(sum) AS total
+      FROM filt
+      GROUP BY yr
+    ),
+    yr_mx AS ( SELECT MAX(total) AS max_total FROM per_year )"""
+        year_cols = """,
+           yr_mx.max_total,
+           (SELECT GROUP_CONCAT(yr) FROM per_year WHERE total = yr_mx.max_total)"""
+
+    sql = f"""
+    WITH filt AS (
+      SELECT dateTime, min, minTime, max, maxTime, sum
+      FROM {table}
+      {where_clause}
+    ),
+    mx AS (
+      SELECT MAX(max) AS max_val, MIN(min) AS min_val, MAX(sum) AS max_day, SUM(sum) AS total
+      FROM filt
+    ){year_sql}
+    SELECT mx.max_val,
+           (SELECT GROUP_CONCAT(strftime('%Y-%m-%dT%H:%M:%SZ', maxTime, 'unixepoch')) FROM filt WHERE max = mx.max_val),
+           mx.min_val,
+           (SELECT GROUP_CONCAT(strftime('%Y-%m-%dT%H:%M:%SZ', minTime, 'unixepoch')) FROM filt WHERE min = mx.min_val),
+           mx.max_day,
+           (SELECT GROUP_CONCAT(strftime('%Y-%m-%dT%H:%M:%SZ', dateTime, 'unixepoch')) FROM filt WHERE sum = mx.max_day),
+           mx.total{year_cols}
+    FROM mx{', yr_mx' if by_year else ''};
+    """
+
+    return sql
+
+
+def get_var_records(db_path, obs_type, where_clause='', params=(), by_year=False):
+    sql = build_records_sql(obs_type, where_clause, by_year)
+
     with get_db_connection(db_path) as conn:
         cur = conn.cursor()
+        cur.execute(sql, params)
+        row = cur.fetchone()
 
-        if func in {'max', 'min'}:
-            sql = f"""
-            WITH per_year AS (
-              SELECT
-                strftime('%Y', dateTime, 'unixepoch') AS yr,
-                {agg}({value_col}) AS target_val
-              FROM {table}
-              WHERE strftime('%m', dateTime, 'unixepoch') = :mm
-              GROUP BY yr
-            )
-            SELECT
-              t.{value_col} AS val,
-              GROUP_CONCAT(datetime(t.{time_col}, 'unixepoch')) AS times
-            FROM {table} AS t
-            JOIN per_year AS py
-              ON strftime('%Y', t.dateTime, 'unixepoch') = py.yr
-             AND strftime('%m', t.dateTime, 'unixepoch') = :mm
-             AND t.{value_col} = py.target_val
-            GROUP BY t.{value_col};
-            """
-            cur.execute(sql, {'mm': mm})
-            row = cur.fetchone()
-            if not row:
-                return None
-            val = row[0]
-            times = []
-            if row[1]:
-                for dt_str in row[1].split(','):
-                    dt = datetime.strptime(dt_str, '%Y-%m-%d %H:%M:%S')
-                    times.append(dt.isoformat() + 'Z')
-            times.sort()
-            return val, times
+    records = {
+        'max_value': row[0],
+        'max_time': parse_db_times(row[1]),
+        'min_value': row[2],
+        'min_time': parse_db_times(row[3]),
+        'sum_max_day': row[4],
+        'sum_max_day_time': parse_db_times(row[5]),
+        'sum_total': row[6]
+    }
 
-        else:
-            # SUM case
-
-            # --- wettest year(s) ---
-            sql_year = f"""
-            WITH per_year AS (
-              SELECT
-                strftime('%Y', dateTime, 'unixepoch') AS yr,
-                SUM({value_col}) AS total
-              FROM {table}
-              WHERE strftime('%m', dateTime, 'unixepoch') = :mm
-              GROUP BY yr
-            ),
-            mx AS ( SELECT MAX(total) AS max_total FROM per_year )
-            SELECT total, GROUP_CONCAT(yr) AS years
-            FROM per_year, mx
-            WHERE total = max_total
-            GROUP BY total;
-            """
-            cur.execute(sql_year, {'mm': mm})
-            row = cur.fetchone()
-            if row:
-                total = row[0]
-                years = row[1].split(',') if row[1] else []
-                years.sort()
-                wettest_year = (total, years)
-            else:
-                wettest_year = None
-
-            # --- wettest day(s) ---
-            sql_day = f"""
-            WITH mx AS (
-              SELECT MAX({value_col}) AS max_day
-              FROM {table}
-              WHERE strftime('%m', dateTime, 'unixepoch') = :mm
-            )
-            SELECT t.{value_col} AS val,
-                   GROUP_CONCAT(datetime(t.{time_col}, 'unixepoch')) AS times
-            FROM {table} AS t
-            JOIN mx ON t.{value_col} = mx.max_day
-            WHERE strftime('%m', t.dateTime, 'unixepoch') = :mm
-            GROUP BY t.{value_col};
-            """
-            cur.execute(sql_day, {'mm': mm})
-            row = cur.fetchone()
-            if row:
-                val = row[0]
-                times = []
-                if row[1]:
-                    for dt_str in row[1].split(','):
-                        dt = datetime.strptime(dt_str, '%Y-%m-%d %H:%M:%S')
-                        times.append(dt.isoformat() + 'Z')
-                times.sort()
-                wettest_day = (val, times)
-            else:
-                wettest_day = None
+    if by_year:
+        records['sum_max_year'] = row[7]
+        records['sum_max_year_time'] = sorted(row[8].split(',')) if row[8] else []
 
-            return wettest_year, wettest_day
+    return records
 
 
-def get_var_yearly_record(db_path, obs_type, year, func='max'):
-    func = func.lower()
-    if func not in {'max', 'min', 'sum'}:
-        raise ValueError("func must be one of {'max','min','sum'}")
+def get_var_daily_records(db_path, obs_type, month_name, day, first_year, last_year):
+    # Parse month name → month number
+    month = MONTH_NUMBERS.get(month_name.strip().capitalize())
+    if month is None:
+        raise ValueError('month_name must be a full month name')
 
-    if func == 'max':
-        value_col, time_col, agg = 'max', 'maxTime', 'MAX'
-    elif func == 'min':
-        value_col, time_col, agg = 'min', 'minTime', 'MIN'
-    else:  # sum case
-        value_col, time_col, agg = 'sum', 'dateTime', 'SUM'
+    where_clause, params = build_range_where_clause(get_utc_ranges(first_year, last_year, month, int(day)))
 
-    table = f'archive_day_{obs_type}'
-    yr = str(int(year))  # normalize
+    return get_var_records(db_path, obs_type, where_clause, params)
 
-    with sqlite3.connect(db_path) as conn:
-        cur = conn.cursor()
 
-        if func in {'max', 'min'}:
-            # Get the extreme value for the year, then collect all tied times
-            sql = f"""
-            WITH mx AS (
-              SELECT {('MAX' if func == 'max' else 'MIN')}({value_col}) AS target_val
-              FROM {table}
-              WHERE strftime('%Y', dateTime, 'unixepoch') = :yr
-            )
-            SELECT t.{value_col} AS val,
-                   GROUP_CONCAT(datetime(t.{time_col}, 'unixepoch')) AS times
-            FROM {table} AS t
-            JOIN mx ON t.{value_col} = mx.target_val
-            WHERE strftime('%Y', t.dateTime, 'unixepoch') = :yr
-            GROUP BY t.{value_col};
-            """
-            cur.execute(sql, {'yr': yr})
-            row = cur.fetchone()
-            if not row:
-                return None
-            val = row[0]
-            times = []
-            if row[1]:
-                for dt_str in row[1].split(','):
-                    dt = datetime.strptime(dt_str, '%Y-%m-%d %H:%M:%S')
-                    times.append(dt.isoformat() + 'Z')
-            times.sort()
-            return val, times
+def get_var_monthly_records(db_path, obs_type, month_name, first_year, last_year):
+    # Parse month name → month number
+    month = MONTH_NUMBERS.get(month_name.strip().capitalize())
+    if month is None:
+        raise ValueError('month_name must be a full month name')
 
-        else:
-            # SUM case: total over the year + greatest single-day sum in that year
-            # 1) total for the year
-            sql_total = f"""
-            SELECT SUM({value_col}) AS total
-            FROM {table}
-            WHERE strftime('%Y', dateTime, 'unixepoch') = :yr;
-            """
-            cur.execute(sql_total, {'yr': yr})
-            total_row = cur.fetchone()
-            total = total_row[0] if total_row and total_row[0] is not None else None
-
-            # 2) greatest single-day sum (with all tied dates)
-            sql_day = f"""
-            WITH mx AS (
-              SELECT MAX({value_col}) AS max_day
-              FROM {table}
-              WHERE strftime('%Y', dateTime, 'unixepoch') = :yr
-            )
-            SELECT t.{value_col} AS val,
-                   GROUP_CONCAT(datetime(t.{time_col}, 'unixepoch')) AS times
-            FROM {table} AS t
-            JOIN mx ON t.{value_col} = mx.max_day
-            WHERE strftime('%Y', t.dateTime, 'unixepoch') = :yr
-            GROUP BY t.{value_col};
-            """
-            cur.execute(sql_day, {'yr': yr})
-            row = cur.fetchone()
-            if row:
-                max_daily_val = row[0]
-                times = []
-                if row[1]:
-                    for dt_str in row[1].split(','):
-                        dt = datetime.strptime(dt_str, '%Y-%m-%d %H:%M:%S')
-                        times.append(dt.isoformat() + 'Z')
-                times.sort()
-                wettest_day = (max_daily_val, times)
-            else:
-                wettest_day = None
+    where_clause, params = build_range_where_clause(get_utc_ranges(first_year, last_year, month))
 
-            if total is None and wettest_day is None:
-                return None
+    return get_var_records(db_path, obs_type, where_clause, params, by_year=True)
 
-            return total, wettest_day
 
+def get_var_yearly_records(db_path, obs_type, year):
+    year = int(year)  # normalize
+    where_clause, params = build_range_where_clause(get_utc_ranges(year, year))
 
-def get_var_alltime_record(db_path, obs_type, func='max'):
-    func = func.lower()
-    if func not in {'max', 'min', 'sum'}:
-        raise ValueError("func must be one of {'max','min','sum'}")
+    return get_var_records(db_path, obs_type, where_clause, params)
 
-    if func == 'max':
-        value_col, time_col, agg = 'max', 'maxTime', 'MAX'
-    elif func == 'min':
-        value_col, time_col, agg = 'min', 'minTime', 'MIN'
-    else:  # sum
-        value_col, time_col, agg = 'sum', 'dateTime', 'SUM'
 
-    table = f'archive_day_{obs_type}'
+def get_var_alltime_records(db_path, obs_type):
+    return get_var_records(db_path, obs_type)
 
-    with sqlite3.connect(db_path) as conn:
-        cur = conn.cursor()
 
-        if func in {'max', 'min'}:
-            sql = f"""
-            WITH mx AS (SELECT {('MAX' if func == 'max' else 'MIN')}({value_col}) AS target_val FROM {table})
-            SELECT t.{value_col} AS val,
-                   GROUP_CONCAT(datetime(t.{time_col}, 'unixepoch')) AS times
-            FROM {table} AS t
-            JOIN mx ON t.{value_col} = mx.target_val
-            GROUP BY t.{value_col};
-            """
-            cur.execute(sql)
-            row = cur.fetchone()
-            if not row:
-                return None
-            val = row[0]
-            times = []
-            if row[1]:
-                for dt_str in row[1].split(','):
-                    dt = datetime.strptime(dt_str, '%Y-%m-%d %H:%M:%S')
-                    times.append(dt.isoformat() + 'Z')
-            times.sort()
-            return val, times
+if numba is not None:
+    @numba.njit(cache=True)
+    def bin_db_rows_kernel(ts, values, starts, ends, op_code):
+        labels = np.empty(len(starts), np.int64)
+        result = np.empty(len(starts), np.float64)
 
-        else:
-            # total across all time
-            sql_total = f"SELECT SUM({value_col}) FROM {table};"
-            cur.execute(sql_total)
-            total_row = cur.fetchone()
-            total = total_row[0] if total_row and total_row[0] is not None else None
-
-            # greatest single-day sum across all time (with tied dates at midnight)
-            sql_day = f"""
-            WITH mx AS (SELECT MAX({value_col}) AS max_day FROM {table})
-            SELECT t.{value_col} AS val,
-                   GROUP_CONCAT(datetime(t.{time_col}, 'unixepoch')) AS times
-            FROM {table} AS t
-            JOIN mx ON t.{value_col} = mx.max_day
-            GROUP BY t.{value_col};
-            """
-            cur.execute(sql_day)
-            row = cur.fetchone()
-            if row:
-                max_daily_val = row[0]
-                times = []
-                if row[1]:
-                    for dt_str in row[1].split(','):
-                        dt = datetime.strptime(dt_str, '%Y-%m-%d %H:%M:%S')
-                        times.append(dt.isoformat() + 'Z')
-                times.sort()
-                wettest_day = (max_daily_val, times)
+        for i in range(len(starts)):
+            if op_code == 0:
+                # AVG, labelled with the first row of the bin
+                total = 0.0
+                count = 0
+                for j in range(starts[i], ends[i]):
+                    if not np.isnan(values[j]):
+                        total += values[j]
+                        count += 1
+                labels[i] = ts[starts[i]]
+                result[i] = total / count if count > 0 else np.nan
             else:
-                wettest_day = None
+                # MIN or MAX, labelled with the first row holding the extreme value
+                best = np.nan
+                best_index = -1
+                for j in range(starts[i], ends[i]):
+                    value = values[j]
+                    if np.isnan(value):
+                        continue
+                    if best_index < 0 or (value < best if op_code == 1 else value > best):
+                        best = value
+                        best_index = j
+                labels[i] = ts[best_index] if best_index >= 0 else ts[ends[i] - 1]
+                result[i] = best
+
+        return labels, result
+
+
+def bin_db_rows(rows, aggregate_func, bin_size):
+    if len(rows) == 0:
+        return []
+
+    ts = rows['dateTime']
+    values = rows['value']
+
+    # Find where each bin starts and ends in the time-ordered rows
+    bins = ts // bin_size
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(bins)) + 1))
+    ends = np.append(starts[1:], len(ts))
+
+    if numba is not None:
+        op_code = {'AVG': 0, 'MIN': 1, 'MAX': 2}[aggregate_func]
+        labels, result = bin_db_rows_kernel(ts, values, starts, ends, op_code)
+    elif aggregate_func == 'AVG':
+        valid = ~np.isnan(values)
+        labels = ts[starts]
+        totals = np.add.reduceat(np.where(valid, values, 0.0), starts)
+        counts = np.add.reduceat(valid.astype(np.int64), starts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result = totals / counts
+    else:
+        reduce = np.fmin if aggregate_func == 'MIN' else np.fmax
+        result = reduce.reduceat(values, starts)
 
-            if total is None and wettest_day is None:
-                return None
+        # Like SQLite, label MIN and MAX bins with the time of the first row holding the extreme value,
+        # or the last row of the bin when it has no values at all
+        labels = ts[ends - 1]
+        bin_index = np.repeat(np.arange(len(starts)), ends - starts)
+        hits = np.flatnonzero(values == result[bin_index])
+        if hits.size:
+            hits = hits[np.concatenate(([True], bin_index[hits][1:] != bin_index[hits][:-1]))]
+            labels[bin_index[hits]] = ts[hits]
 
-            return total, wettest_day
+    return [(label, None if math.isnan(value) else value) for label, value in zip(labels.tolist(), result.tolist())]
 
 
-def aggregate_db_data(db_path, var, ts_start=None, ts_end=None, aggregate_func='AVG', bin_size=3600):
+def aggregate_db_data(db_path, var, ts_start=None, ts_end=None, aggregate_func='AVG', bin_size=3600,
+                      column_type='REAL'):
     # Build the where clause
-    where_clause = build_where_clause(ts_start, ts_end)
+    where_clause, params = build_where_clause(ts_start, ts_end)
 
     # Check bin_size
     if bin_size <= 0:
@@ -436,33 +669,88 @@ def aggregate_db_data(db_path, var, ts_start=None, ts_end=None, aggregate_func='
     # Get aggregated data from the database
     with get_db_connection(db_path) as conn:
         cur = conn.cursor()
-        cur.execute(f'SELECT dateTime,{aggregate_func}({var}) FROM archive {where_clause} GROUP BY dateTime/{bin_size}')
-        return cur.fetchall()
+        # Integer columns keep SQLite's GROUP BY, MIN and MAX read as float64 would come back as floats
+        if np is None or not is_real_type(column_type):
+            cur.execute(f'SELECT dateTime,{aggregate_func}({var}) FROM archive {where_clause} GROUP BY dateTime/?',
+                        params + (bin_size,))
+            return cur.fetchall()
+
+        # Bin the raw rows with NumPy, which is much faster than SQLite's GROUP BY over long ranges
+        cur.execute(f'SELECT dateTime,{var} FROM archive {where_clause} ORDER BY dateTime', params)
+        rows = np.fromiter(cur, dtype=DB_ROW_DTYPE)
+
+    return bin_db_rows(rows, aggregate_func, bin_size)
 
 
 def data_router(config_dict: dict):
-    router = APIRouter()
+    # Close the pooled database connections when the server shuts down, and encode responses with orjson
+    # even if the router is included in an app with a different default response class
+    router = APIRouter(on_shutdown=[close_db_connections], default_response_class=ORJSONResponse)
 
     # Find the weewx database path
     weewx_config_path = Path(config_dict.get('config_path'))
     weewx_db_path = weewx_config_path.parent / 'archive' / 'weewx.sdb'
 
-    # Get period of record from the database
-    datetime_stats = get_var_stats(weewx_db_path, 'dateTime')
-    records_start = datetime.fromtimestamp(datetime_stats['min'])
-    records_end = datetime.fromtimestamp(datetime_stats['max'])
+    # Switch the database to WAL journal mode if enabled in config
+    wal_enabled = config_dict.get('DataAPI', {}).get('wal_mode', 'False').upper() == 'TRUE'
+    if wal_enabled:
+        enable_db_wal(weewx_db_path)
+
+    db_info = get_db_info(weewx_db_path)
+
+    # Get the start of the period of record, the end moves with every new archive record so it is read when needed
+    ts_first = db_info['first_record'] if db_info['first_record'] is not None else time.time()
+    records_start = datetime.fromtimestamp(ts_first)
+    records_first_year = datetime.fromtimestamp(ts_first, timezone.utc).year
+
+    # Get the archive schema, it does not change while the server is running
+    db_column_types = dict(db_info['columns'])
+    db_column_names_json = orjson.dumps(list(db_column_types))
+
+    # Stream archive rows straight from the database only when reads can't hold up WeeWX saving records
+    db_stream_rows = db_info['journal_mode'] == 'wal'
+
+    def check_obs_type(obs_type):
+        # Column names can't be bound as parameters, so only allow known archive columns into the SQL
+        if obs_type not in db_column_types:
+            raise HTTPException(status_code=400, detail=f'Unknown observation type: {obs_type}')
+
+    # Records are read from the daily summaries, which cover a different set of obs types than the archive columns,
+    # e.g. wind has a summary table but no column, while usUnits and interval have a column but no summary
+    db_summary_types = frozenset(db_info['summary_types'])
+
+    def check_summary_type(obs_type):
+        # Table names can't be bound as parameters either, so only allow known daily summaries into the SQL
+        if obs_type not in db_summary_types:
+            raise HTTPException(status_code=400, detail=f'Unknown observation type: {obs_type}')
+
+    # Index the obs types that are charted most often
+    indexed_obs_types = config_dict.get('DataAPI', {}).get('indexed_obs_types', [])
+    if isinstance(indexed_obs_types, str):
+        indexed_obs_types = [indexed_obs_types]
+    indexed_obs_types = [obs_type for obs_type in indexed_obs_types if obs_type in db_column_types]
+    if indexed_obs_types:
+        create_db_indexes(weewx_db_path, indexed_obs_types)
 
     # =================================================================================================================
     # Metadata
 
+    # Serialize the station metadata once, it does not change while the server is running
+    station = config_dict.get('Station', {})
+    station_json = orjson.dumps(station)
+    station_name_json = orjson.dumps(station.get('location', ''))
+    station_location_json = orjson.dumps((station.get('latitude', None), station.get('longitude', None)))
+    station_elevation_json = orjson.dumps(station.get('altitude', ''))
+    station_type_json = orjson.dumps(station.get('station_type', ''))
+
     @router.get(
         '/station',
         summary='Station metadata',
         description='Retrieves all metadata associated with the weather station.',
         tags=['Station Metadata'],
     )
-    def station_metadata():
-        return config_dict.get('Station', {})
+    async def station_metadata(request: Request):
+        return static_json_response(station_json, request)
 
     @router.get(
         '/station/name',
@@ -470,8 +758,8 @@ def data_router(config_dict: dict):
         description='Retrieves the name of the weather station.',
         tags=['Station Metadata'],
     )
-    def station_name():
-        return config_dict.get('Station', {}).get('location', '')
+    async def station_name(request: Request):
+        return static_json_response(station_name_json, request)
 
     @router.get(
         '/station/location',
@@ -479,10 +767,8 @@ def data_router(config_dict: dict):
         description='Retrieves the latitude and longitude of the weather station.',
         tags=['Station Metadata'],
     )
-    def station_location():
-        latitude = config_dict.get('Station', {}).get('latitude', None)
-        longitude = config_dict.get('Station', {}).get('longitude', None)
-        return latitude, longitude
+    async def station_location(request: Request):
+        return static_json_response(station_location_json, request)
 
     @router.get(
         '/station/elevation',
@@ -490,8 +776,8 @@ def data_router(config_dict: dict):
         description='Retrieves the elevation of the weather station.',
         tags=['Station Metadata'],
     )
-    def station_elevation():
-        return config_dict.get('Station', {}).get('altitude', '')
+    async def station_elevation(request: Request):
+        return static_json_response(station_elevation_json, request)
 
     @router.get(
         '/station/type',
@@ -499,51 +785,126 @@ def data_router(config_dict: dict):
         description='Retrieves the type of hardware for the weather station.',
         tags=['Station Metadata'],
     )
-    def station_type():
-        return config_dict.get('Station', {}).get('station_type', '')
+    async def station_type(request: Request):
+        return static_json_response(station_type_json, request)
 
     # =================================================================================================================
     # Database
 
+    # Get the database unit system
+    units_system_key = config_dict.get('StdConvert', {}).get('target_unit', weewx.US)
+
+    units_map = {
+        'US': weewx.US,
+        'METRIC': weewx.METRIC,
+        'METRICWX': weewx.METRICWX
+    }
+
+    units_system = units_map.get(units_system_key, weewx.US)
+
+    @lru_cache(maxsize=256)
+    def get_obs_unit(obs_type):
+        # Get the units for the obs type, these are fixed by the unit system
+        unit, unit_group = weewx.units.getStandardUnitType(units_system, obs_type)
+
+        return unit
+
+    # Cache serialized responses for historical ranges, repeated dashboard loads then skip the database
+    aggregate_cache = ResponseCache()
+    stats_cache = ResponseCache()
+
+    async def is_historical(ts_end):
+        # WeeWX only appends records, so ranges that end before the newest archive record won't change.
+        # A clock-based cutoff is not enough, records can arrive late after an outage or a catch-up import
+        if ts_end is None:
+            return False
+
+        last_update = await asyncio.to_thread(get_db_last_update, weewx_db_path)
+        return last_update is not None and ts_end < last_update
+
+    def get_historical_aggregate(obs_type, ts_start, ts_end, aggregate_func, bin_size):
+        return aggregate_cache.get_or_create(
+            (obs_type, ts_start, ts_end, aggregate_func, bin_size),
+            lambda: orjson.dumps(aggregate_db_data(weewx_db_path, obs_type, ts_start=ts_start, ts_end=ts_end,
+                                                   aggregate_func=aggregate_func, bin_size=bin_size,
+                                                   column_type=db_column_types[obs_type])))
+
+    def get_historical_stats(obs_type, ts_start, ts_end):
+        return stats_cache.get_or_create(
+            (obs_type, ts_start, ts_end),
+            lambda: orjson.dumps(get_var_stats(weewx_db_path, obs_type, ts_start=ts_start, ts_end=ts_end)))
+
+    # Cache the records keyed on the newest archive record, WeeWX updates the daily summaries with each record
+    # so older entries are never looked up again and age out of the cache
+    @lru_cache(maxsize=RESPONSE_CACHE_SIZE)
+    def get_cached_records(records_func, obs_type, args, last_update):
+        return records_func(weewx_db_path, obs_type, *args)
+
+    def get_records(records_func, obs_type, *args):
+        return get_cached_records(records_func, obs_type, args, get_db_last_update(weewx_db_path))
+
     @router.get(
         '/database/obs_types',
         summary='List observation types',
         description='Retrieves a list of all available observation types in the database.',
         tags=['Database'],
     )
-    def get_var_list():
-        # Get the list of variables
-        db_var_list = get_db_columns(weewx_db_path)
+    async def get_var_list(request: Request):
+        return static_json_response(db_column_names_json, request)
 
-        # Keep only the variable names
-        db_var_list = [var['name'] for var in db_var_list]
+    @router.get(
+        '/database/data',
+        summary='Get data for several observation types',
+        description='Retrieves the data for several observation types from the database in a single query, '
+                    'as lists keyed by observation type alongside a shared dateTime list.',
+        tags=['Database'],
+    )
+    async def get_multi_data(obs_types: list[str] = Query(..., alias='vars',
+                                                          description='Observation types, repeated or comma-separated'),
+                             start: int = None, end: int = None):
+        # Accept both ?vars=a&vars=b and ?vars=a,b, dateTime is always included
+        variables = [var for value in obs_types for var in value.split(',') if var and var != 'dateTime']
+        variables = list(dict.fromkeys(variables))
+        for var in variables:
+            check_obs_type(var)
+
+        ts_start = parse_time_param(start)
+        ts_end = parse_time_param(end)
 
-        return db_var_list
+        # Get the data
+        data = await asyncio.to_thread(get_db_data_columns, weewx_db_path, variables, ts_start=ts_start, ts_end=ts_end,
+                                       column_types=db_column_types)
+
+        return json_response(orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY))
 
     @router.get(
         '/database/{obs_type}/data',
         summary='Get data for observation type',
-        description='Retrieves a list of all data associated with a given observation type from the database.',
+        description='Retrieves a list of all data associated with a given observation type from the database, '
+                    'as a JSON array or as newline-delimited JSON rows.',
         tags=['Database'],
     )
-    def get_all_data(obs_type: str, start: int = None, end: int = None):
-
-        if start is not None:
-            start = datetime.strptime(str(start), '%Y%m%d%H%M')
-            ts_start = int(start.timestamp())
-        else:
-            ts_start = None
-
-        if end is not None:
-            end = datetime.strptime(str(end), '%Y%m%d%H%M')
-            ts_end = int(end.timestamp())
+    async def get_all_data(obs_type: str, start: int = None, end: int = None,
+                           format: DataFormat = Query(DataFormat.json, description='Response encoding')):
+        check_obs_type(obs_type)
+
+        ts_start = parse_time_param(start)
+        ts_end = parse_time_param(end)
+
+        if db_stream_rows:
+            # Fetch the first batch before responding, so a busy pool or bad query still gets an error status
+            rows = iter_db_data(weewx_db_path, obs_type, ts_start=ts_start, ts_end=ts_end)
+            first_rows = await asyncio.to_thread(next, rows, None)
+            rows = itertools.chain([first_rows], rows) if first_rows is not None else []
         else:
-            ts_end = None
+            # Read the data in batches, then stream the encoding so the whole response is never built at once
+            rows = await asyncio.to_thread(get_db_data_batches, weewx_db_path, obs_type, ts_start=ts_start,
+                                           ts_end=ts_end)
 
-        # Get the data
-        data = get_db_data(weewx_db_path, obs_type, ts_start=ts_start, ts_end=ts_end)
+        if format == DataFormat.ndjson:
+            return StreamingResponse(stream_ndjson(rows), media_type='application/x-ndjson')
 
-        return data
+        return StreamingResponse(stream_json_array(rows), media_type='application/json')
 
     @router.get(
         '/database/{obs_type}/data/latest',
@@ -551,15 +912,20 @@ def data_router(config_dict: dict):
         description='Retrieves the latest record in the database for a given observation type.',
         tags=['Database'],
     )
-    def get_latest_ob(obs_type: str):
+    async def get_latest_ob(obs_type: str):
+        check_obs_type(obs_type)
+
         try:
             # Get the latest value
-            latest_ob = get_db_data(weewx_db_path, obs_type, latest=True)
+            latest_ob = await asyncio.to_thread(get_db_latest, weewx_db_path, obs_type)
 
-            if latest_ob is not None and len(latest_ob) > 0:
-                ts, value = latest_ob[0]
+            if latest_ob is not None:
+                ts, value = latest_ob
                 return {'timestamp': ts, 'value': value}
 
+        except HTTPException:
+            # Keep the status of errors that are already HTTP responses, like a busy connection pool
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
@@ -571,25 +937,24 @@ def data_router(config_dict: dict):
         description='Retrieves an aggregated list of data from the database for a given observation type.',
         tags=['Database'],
     )
-    def get_aggregated_data(obs_type: str, start: int = None, end: int = None, function: str = 'avg', hours: int = 1):
+    async def get_aggregated_data(obs_type: str, start: int = None, end: int = None, function: str = 'avg', hours: int = 1):
+        check_obs_type(obs_type)
 
-        if start is not None:
-            start = datetime.strptime(str(start), '%Y%m%d%H%M')
-            ts_start = int(start.timestamp())
-        else:
-            ts_start = None
+        ts_start = parse_time_param(start)
+        ts_end = parse_time_param(end)
 
-        if end is not None:
-            end = datetime.strptime(str(end), '%Y%m%d%H%M')
-            ts_end = int(end.timestamp())
-        else:
-            ts_end = None
+        if await is_historical(ts_end):
+            data = await asyncio.to_thread(get_historical_aggregate, obs_type, ts_start, ts_end, function.upper(),
+                                           3600 * hours)
+            return json_response(data)
 
         # Get the data
-        data = aggregate_db_data(weewx_db_path, obs_type, ts_start=ts_start, ts_end=ts_end, aggregate_func=function,
-                                 bin_size=3600 * hours)
+        data = await asyncio.to_thread(aggregate_db_data, weewx_db_path, obs_type, ts_start=ts_start, ts_end=ts_end,
+                                       aggregate_func=function, bin_size=3600 * hours,
+                                       column_type=db_column_types[obs_type])
 
-        return data
+        # Encode the rows directly, skipping FastAPI's per-element jsonable_encoder pass
+        return json_response(orjson.dumps(data))
 
     @router.get(
         '/database/{obs_type}/data/stats',
@@ -597,22 +962,18 @@ def data_router(config_dict: dict):
         description='Retrieves the statistics for a given observation type.',
         tags=['Database'],
     )
-    def get_stats(obs_type: str, start: int = None, end: int = None):
+    async def get_stats(obs_type: str, start: int = None, end: int = None):
+        check_obs_type(obs_type)
 
-        if start is not None:
-            start = datetime.strptime(str(start), '%Y%m%d%H%M')
-            ts_start = int(start.timestamp())
-        else:
-            ts_start = None
+        ts_start = parse_time_param(start)
+        ts_end = parse_time_param(end)
 
-        if end is not None:
-            end = datetime.strptime(str(end), '%Y%m%d%H%M')
-            ts_end = int(end.timestamp())
-        else:
-            ts_end = None
+        if await is_historical(ts_end):
+            data = await asyncio.to_thread(get_historical_stats, obs_type, ts_start, ts_end)
+            return json_response(data)
 
         # Get the data
-        data = get_var_stats(weewx_db_path, obs_type, ts_start=ts_start, ts_end=ts_end)
+        data = await asyncio.to_thread(get_var_stats, weewx_db_path, obs_type, ts_start=ts_start, ts_end=ts_end)
 
         return data
 
@@ -622,22 +983,8 @@ def data_router(config_dict: dict):
         description='Retrieves the units for a given observation type.',
         tags=['Database'],
     )
-    def get_var_units(obs_type: str):
-        # Get the database unit system
-        units_system_key = config_dict.get('StdConvert', {}).get('target_unit', weewx.US)
-
-        units_map = {
-            'US': weewx.US,
-            'METRIC': weewx.METRIC,
-            'METRICWX': weewx.METRICWX
-        }
-
-        units_system = units_map.get(units_system_key, weewx.US)
-
-        # Get the units for the obs type
-        unit, unit_group = weewx.units.getStandardUnitType(units_system, obs_type)
-
-        return unit
+    async def get_var_units(obs_type: str):
+        return get_obs_unit(obs_type)
 
     @router.get(
         '/database/{obs_type}/datatype',
@@ -645,15 +992,8 @@ def data_router(config_dict: dict):
         description='Retrieves the data type for a given observation type.',
         tags=['Database'],
     )
-    def get_var_dtype(obs_type: str):
-        # Get the list of variables
-        db_var_list = get_db_columns(weewx_db_path)
-
-        for var in db_var_list:
-            if var['name'] == obs_type:
-                return var['type']
-
-        return None
+    async def get_var_dtype(obs_type: str):
+        return db_column_types.get(obs_type)
 
     # =================================================================================================================
     # Records
@@ -664,7 +1004,9 @@ def data_router(config_dict: dict):
         description='Retrieves the period of record.',
         tags=['Records'],
     )
-    def get_period_of_record():
+    async def get_period_of_record():
+        records_end = datetime.fromtimestamp(await asyncio.to_thread(get_db_last_update, weewx_db_path))
+
         # Calculate the number of days and years
         num_days = (records_end - records_start).days
         num_years = round(num_days / 365.25, 1)
@@ -681,23 +1023,23 @@ def data_router(config_dict: dict):
         description='Retrieves the daily record for a given observation type.',
         tags=['Records'],
     )
-    def get_daily_record(
+    async def get_daily_record(
             obs_type: str,
-            month: str = Query(..., description='Month', pattern=REGEX_PATTERN),
+            month: MonthName = Query(..., description='Month'),
             day: int = Query(..., ge=1, le=30, description='Day of the Month')
     ):
+        check_summary_type(obs_type)
 
-        max_value, max_time = get_var_daily_record(weewx_db_path, obs_type, month, day, 'max')
-        min_value, min_time = get_var_daily_record(weewx_db_path, obs_type, month, day, 'min')
-        sum_value, sum_time = get_var_daily_record(weewx_db_path, obs_type, month, day, 'sum')
+        records = await asyncio.to_thread(get_records, get_var_daily_records, obs_type, month, day,
+                                          records_first_year, datetime.now(timezone.utc).year)
 
         resp_dict = {
-            'max_value': max_value,
-            'max_time': max_time,
-            'min_value': min_value,
-            'min_time': min_time,
-            'sum_value': sum_value,
-            'sum_time': sum_time
+            'max_value': records['max_value'],
+            'max_time': records['max_time'],
+            'min_value': records['min_value'],
+            'min_time': records['min_time'],
+            'sum_value': records['sum_max_day'],
+            'sum_time': records['sum_max_day_time']
         }
 
         return resp_dict
@@ -708,10 +1050,11 @@ def data_router(config_dict: dict):
         description='Retrieves the daily record for the current day for a given observation type.',
         tags=['Records'],
     )
-    def get_daily_record_today(obs_type: str):
-        month = datetime.now().strftime('%B')
-        day = datetime.now().day
-        return get_daily_record(obs_type, month, day)
+    async def get_daily_record_today(obs_type: str):
+        today_dt = datetime.now()
+        month = MONTH_NAMES[today_dt.month - 1]
+        day = today_dt.day
+        return await get_daily_record(obs_type, month, day)
 
     @router.get(
         '/records/{obs_type}/monthly',
@@ -719,24 +1062,24 @@ def data_router(config_dict: dict):
         description='Retrieves the monthly record for a given observation type.',
         tags=['Records'],
     )
-    def get_monthly_record(
+    async def get_monthly_record(
             obs_type: str,
-            month: str = Query(..., description='Month', pattern=REGEX_PATTERN),
+            month: MonthName = Query(..., description='Month'),
     ):
+        check_summary_type(obs_type)
 
-        max_value, max_time = get_var_monthly_record(weewx_db_path, obs_type, month, 'max')
-        min_value, min_time = get_var_monthly_record(weewx_db_path, obs_type, month, 'min')
-        sum_month_total, sum_max_day = get_var_monthly_record(weewx_db_path, obs_type, month, 'sum')
+        records = await asyncio.to_thread(get_records, get_var_monthly_records, obs_type, month,
+                                          records_first_year, datetime.now(timezone.utc).year)
 
         resp_dict = {
-            'max_value': max_value,
-            'max_time': max_time,
-            'min_value': min_value,
-            'min_time': min_time,
-            'sum_value': sum_month_total[0],
-            'sum_time': sum_month_total[1],
-            'sum_max_day': sum_max_day[0],
-            'sum_max_day_time': sum_max_day[1]
+            'max_value': records['max_value'],
+            'max_time': records['max_time'],
+            'min_value': records['min_value'],
+            'min_time': records['min_time'],
+            'sum_value': records['sum_max_year'],
+            'sum_time': records['sum_max_year_time'],
+            'sum_max_day': records['sum_max_day'],
+            'sum_max_day_time': records['sum_max_day_time']
         }
 
         return resp_dict
@@ -747,9 +1090,9 @@ def data_router(config_dict: dict):
         description='Retrieves the monthly record for the current month for a given observation type.',
         tags=['Records'],
     )
-    def get_monthly_record_current(obs_type: str):
-        current_month = datetime.now().strftime('%B')
-        return get_monthly_record(obs_type, current_month)
+    async def get_monthly_record_current(obs_type: str):
+        current_month = MONTH_NAMES[datetime.now().month - 1]
+        return await get_monthly_record(obs_type, current_month)
 
     @router.get(
         '/records/{obs_type}/year',
@@ -757,22 +1100,27 @@ def data_router(config_dict: dict):
         description='Retrieves the records for a year for a given observation type.',
         tags=['Records'],
     )
-    def get_year_record(
+    async def get_year_record(
             obs_type: str,
-            year: int = Query(..., ge=records_start.year, le=records_end.year, description='Year'),
+            year: int = Query(..., ge=records_start.year, description='Year'),
     ):
-        max_value, max_time = get_var_yearly_record(weewx_db_path, obs_type, year, 'max')
-        min_value, min_time = get_var_yearly_record(weewx_db_path, obs_type, year, 'min')
-        sum_year_total, sum_max_day = get_var_yearly_record(weewx_db_path, obs_type, year, 'sum')
+        check_summary_type(obs_type)
+
+        # Check the year against the latest record, which can be in a later year than when the server started
+        records_last_year = datetime.fromtimestamp(await asyncio.to_thread(get_db_last_update, weewx_db_path)).year
+        if year > records_last_year:
+            raise HTTPException(status_code=400, detail=f'Year must be no later than {records_last_year}')
+
+        records = await asyncio.to_thread(get_records, get_var_yearly_records, obs_type, year)
 
         resp_dict = {
-            'max_value': max_value,
-            'max_time': max_time,
-            'min_value': min_value,
-            'min_time': min_time,
-            'sum_value': sum_year_total,
-            'sum_max_day': sum_max_day[0],
-            'sum_max_day_time': sum_max_day[1]
+            'max_value': records['max_value'],
+            'max_time': records['max_time'],
+            'min_value': records['min_value'],
+            'min_time': records['min_time'],
+            'sum_value': records['sum_total'],
+            'sum_max_day': records['sum_max_day'],
+            'sum_max_day_time': records['sum_max_day_time']
         }
 
         return resp_dict
@@ -783,9 +1131,9 @@ def data_router(config_dict: dict):
         description='Retrieves the records for the current year for a given observation type.',
         tags=['Records'],
     )
-    def get_year_record_current(obs_type: str):
+    async def get_year_record_current(obs_type: str):
         year = datetime.now().year
-        return get_year_record(obs_type, year)
+        return await get_year_record(obs_type, year)
 
     @router.get(
         '/records/{obs_type}/alltime',
@@ -793,19 +1141,19 @@ def data_router(config_dict: dict):
         description='Retrieves the all-time record for a given observation type.',
         tags=['Records'],
     )
-    def get_alltime_record(obs_type: str):
-        max_value, max_time = get_var_alltime_record(weewx_db_path, obs_type, 'max')
-        min_value, min_time = get_var_alltime_record(weewx_db_path, obs_type, 'min')
-        sum_all, sum_max_day = get_var_alltime_record(weewx_db_path, obs_type, 'sum')
+    async def get_alltime_record(obs_type: str):
+        check_summary_type(obs_type)
+
+        records = await asyncio.to_thread(get_records, get_var_alltime_records, obs_type)
 
         resp_dict = {
-            'max_value': max_value,
-            'max_time': max_time,
-            'min_value': min_value,
-            'min_time': min_time,
-            'sum_value': sum_all,
-            'sum_max_day': sum_max_day[0],
-            'sum_max_day_time': sum_max_day[1]
+            'max_value': records['max_value'],
+            'max_time': records['max_time'],
+            'min_value': records['min_value'],
+            'min_time': records['min_time'],
+            'sum_value': records['sum_total'],
+            'sum_max_day': records['sum_max_day'],
+            'sum_max_day_time': records['sum_max_day_time']
         }
 
         return resp_dict
@@ -821,16 +1169,44 @@ def data_router(config_dict: dict):
         # Load the PRISM normals
         prism_normals = load_prism_normals(normals_path)
 
+        # Summarize each month once, the normals don't change after loading
+        prism_monthly_normals = {}
+        if prism_normals is not None:
+            for month_name, month_normals in prism_normals['daily_normals'].items():
+                prism_monthly_normals[month_name] = {
+                    'precip_total': math.fsum(month_normals['precip_total'].values()),
+                    'temp_max': max(month_normals['temp_max'].values()),
+                    'temp_avg': mean(month_normals['temp_avg'].values()),
+                    'temp_min': min(month_normals['temp_min'].values()),
+                }
+
+            # Serialize the responses once, they are returned as-is and keyed by MonthName so the validated
+            # query value is used for the lookup directly
+            prism_normals_json = orjson.dumps(prism_normals)
+            prism_annual_json = orjson.dumps(prism_normals['annual_norms'])
+            prism_monthly_json = {MonthName(month_name): orjson.dumps(month_normals)
+                                  for month_name, month_normals in prism_monthly_normals.items()}
+            prism_daily_json = {
+                (MonthName(month_name), int(day)): orjson.dumps({
+                    'precip_total': month_normals['precip_total'][day],
+                    'temp_max': month_normals['temp_max'][day],
+                    'temp_avg': month_normals['temp_avg'][day],
+                    'temp_min': month_normals['temp_min'][day],
+                })
+                for month_name, month_normals in prism_normals['daily_normals'].items()
+                for day in month_normals['precip_total']
+            }
+
         @router.get(
             '/normals/prism',
             summary='Get complete normals from PRISM',
             description='Retrieves the all normals for total precipitation and max, min, and average temperature derived from PRISM.',
             tags=['Normals'],
         )
-        def get_prism_normals():
+        async def get_prism_normals(request: Request):
             if prism_normals is None:
-                return HTTPException(status_code=500, detail='No PRISM normals could be found for your location.')
-            return prism_normals
+                raise HTTPException(status_code=500, detail='No PRISM normals could be found for your location.')
+            return static_json_response(prism_normals_json, request)
 
         @router.get(
             '/normals/prism/annual',
@@ -838,10 +1214,10 @@ def data_router(config_dict: dict):
             description='Retrieves the annual normals for total precipitation and max, min, and average temperature derived from PRISM.',
             tags=['Normals'],
         )
-        def get_prism_normals_annual():
+        async def get_prism_normals_annual(request: Request):
             if prism_normals is None:
-                return HTTPException(status_code=500, detail='No PRISM normals could be found for your location.')
-            return prism_normals['annual_norms']
+                raise HTTPException(status_code=500, detail='No PRISM normals could be found for your location.')
+            return static_json_response(prism_annual_json, request)
 
         @router.get(
             '/normals/prism/monthly',
@@ -849,20 +1225,14 @@ def data_router(config_dict: dict):
             description='Retrieves the monthly normals for total precipitation and max, min, and average temperature derived from PRISM for a given month.',
             tags=['Normals'],
         )
-        def get_prism_normals_monthly(month: str = Query(..., description='Month', pattern=REGEX_PATTERN)):
+        async def get_prism_normals_monthly(request: Request, month: MonthName = Query(..., description='Month')):
             if prism_normals is None:
-                return HTTPException(status_code=500, detail='No PRISM normals could be found for your location.')
+                raise HTTPException(status_code=500, detail='No PRISM normals could be found for your location.')
 
             try:
-                resp_dict = {
-                    'precip_total': math.fsum(prism_normals['daily_normals'][month.lower()]['precip_total'].values()),
-                    'temp_max': max(prism_normals['daily_normals'][month.lower()]['temp_max'].values()),
-                    'temp_avg': mean(prism_normals['daily_normals'][month.lower()]['temp_avg'].values()),
-                    'temp_min': min(prism_normals['daily_normals'][month.lower()]['temp_min'].values()),
-                }
-                return resp_dict
+                return static_json_response(prism_monthly_json[month], request)
             except KeyError:
-                return HTTPException(status_code=404, detail=f'No normals found for {month}.')
+                raise HTTPException(status_code=404, detail=f'No normals found for {month}.')
 
         @router.get(
             '/normals/prism/monthly/current',
@@ -870,11 +1240,17 @@ def data_router(config_dict: dict):
             description='Retrieves the monthly normals for total precipitation and max, min, and average temperature derived from PRISM for the currernt month.',
             tags=['Normals'],
         )
-        def get_prism_normals_monthly_current():
+        async def get_prism_normals_monthly_current(request: Request):
             today_dt = datetime.today()
-            month = today_dt.strftime('%B')
+            month = MONTH_NAMES[today_dt.month - 1]
 
-            return get_prism_normals_monthly(month)
+            response = await get_prism_normals_monthly(request, month)
+
+            # The current month changes, so clients revalidate instead of reusing their copy
+            if isinstance(response, Response):
+                response.headers['Cache-Control'] = 'no-cache'
+
+            return response
 
         @router.get(
             '/normals/prism/daily',
@@ -882,22 +1258,16 @@ def data_router(config_dict: dict):
             description='Retrieves the daily normals for total precipitation and max, min, and average temperature derived from PRISM for a given month and day.',
             tags=['Normals'],
         )
-        def get_prism_normals_daily(month: str = Query(..., description='Month', pattern=REGEX_PATTERN),
+        async def get_prism_normals_daily(request: Request, month: MonthName = Query(..., description='Month'),
                                     day: int = Query(..., ge=1, le=30, description='Day of the Month')
                                     ):
             if prism_normals is None:
-                return HTTPException(status_code=500, detail='No PRISM normals could be found for your location.')
+                raise HTTPException(status_code=500, detail='No PRISM normals could be found for your location.')
 
             try:
-                resp_dict = {
-                    'precip_total': prism_normals['daily_normals'][month.lower()]['precip_total'][str(day)],
-                    'temp_max': prism_normals['daily_normals'][month.lower()]['temp_max'][str(day)],
-                    'temp_avg': prism_normals['daily_normals'][month.lower()]['temp_avg'][str(day)],
-                    'temp_min': prism_normals['daily_normals'][month.lower()]['temp_min'][str(day)],
-                }
-                return resp_dict
+                return static_json_response(prism_daily_json[(month, day)], request)
             except KeyError:
-                return HTTPException(status_code=404, detail=f'No normals found for {month} {day}.')
+                raise HTTPException(status_code=404, detail=f'No normals found for {month} {day}.')
 
         @router.get(
             '/normals/prism/daily/today',
@@ -905,11 +1275,17 @@ def data_router(config_dict: dict):
             description='Retrieves the daily normals for total precipitation and max, min, and average temperature derived from PRISM for the current day.',
             tags=['Normals'],
         )
-        def get_prism_normals_today():
+        async def get_prism_normals_today(request: Request):
             today_dt = datetime.today()
-            month = today_dt.strftime('%B')
+            month = MONTH_NAMES[today_dt.month - 1]
             day = today_dt.day
 
-            return get_prism_normals_daily(month, day)
+            response = await get_prism_normals_daily(request, month, day)
+
+            # The current day changes, so clients revalidate instead of reusing their copy
+            if isinstance(response, Response):
+                response.headers['Cache-Control'] = 'no-cache'
+
+            return response
 
     return router
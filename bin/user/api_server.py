@@ -1,19 +1,22 @@
 # Carter Humphreys
 # https://github.com/HumphreysCarter/weewx-fastapi
 
-import json
 import math
+import orjson
 import logging
 import uvicorn
 import calendar
 import requests
 import threading
+from requests.adapters import HTTPAdapter, Retry
 from pathlib import Path
 from weewx.engine import StdService
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
 from statistics import mean
 
-from .api_router import data_router
+from .api_router import data_router, close_db_connections
 
 log = logging.getLogger(__name__)
 
@@ -40,27 +43,17 @@ def prism_process_daily_norms(daily_normals):
         'tmin': 'temp_min'
     }
 
-    # Build julian_day -> (month, day)
-    jd_to_md = {}
-    day_counter = 1
+    # Split each series into months by slicing at the julian day each month starts, month names as outer keys
+    monthly_normals = {}
+    start = 0
     for month in range(1, 13):
         days_in_month = 29 if month == 2 else calendar.monthrange(2000, month)[1]
-        for day in range(1, days_in_month + 1):
-            jd_to_md[day_counter] = (month, day)
-            day_counter += 1
-
-    # Month names as outer keys
-    monthly_normals = {calendar.month_name[m].lower(): {} for m in range(1, 13)}
-
-    # Fill values
-    for key, values in daily_normals.items():
-        new_key = key_map.get(key, key)
-        for jd, value in enumerate(values, start=1):
-            month, day = jd_to_md[jd]
-            month_name = calendar.month_name[month].lower()
-            if new_key not in monthly_normals[month_name]:
-                monthly_normals[month_name][new_key] = {}
-            monthly_normals[month_name][new_key][day] = value
+        days = range(1, days_in_month + 1)
+        monthly_normals[calendar.month_name[month].lower()] = {
+            key_map.get(key, key): dict(zip(days, values[start:start + days_in_month]))
+            for key, values in daily_normals.items()
+        }
+        start += days_in_month
 
     return monthly_normals
 
@@ -93,12 +86,18 @@ def download_prism_normals(config_dict):
         # Request headers
         headers = {'User-Agent': 'https://github.com/HumphreysCarter/weewx-fastapi'}
 
+        # Retry the request when the PRISM server is briefly unavailable, the query only reads data so
+        # it is safe to repeat the POST
+        retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504], allowed_methods=['POST'])
+
         # Make data request
         try:
-            resp = requests.post(prism_api_url, data=payload, headers=headers, timeout=30)
+            with requests.Session() as session:
+                session.mount('https://', HTTPAdapter(max_retries=retries))
+                resp = session.post(prism_api_url, data=payload, headers=headers, timeout=(3.05, 30))
             resp.raise_for_status()
             try:
-                prism_data = resp.json()
+                prism_data = orjson.loads(resp.content)
                 if 'result' in prism_data and 'data' in prism_data['result']:
                     # Process data
                     daily_dict = prism_process_daily_norms(prism_data['result']['data'])
@@ -106,8 +105,7 @@ def download_prism_normals(config_dict):
 
                     # Create norms dict for JSON file
                     norms_dict = {'annual_norms': annual_dict, 'daily_normals': daily_dict}
-                    with open(normals_path, 'w') as f:
-                        json.dump(norms_dict, f, indent=4)
+                    normals_path.write_bytes(orjson.dumps(norms_dict, option=orjson.OPT_NON_STR_KEYS))
 
                     log.info('PRISM normals downloaded and saved to file')
                 else:
@@ -148,6 +146,7 @@ class DataAPI(StdService):
             self._thread.stop()
             self._thread.join(timeout=10)
             self._thread = None
+            close_db_connections()
             log.info('DataAPI: API server thread stopped')
 
 
@@ -160,11 +159,15 @@ class ApiServerThread(threading.Thread):
         self.host = config_dict.get('DataAPI', {}).get('server_host', 'localhost')
         self.port = int(config_dict.get('DataAPI', {}).get('server_port', 8000))
 
+        # Check if request logging is enabled in config
+        self.access_log = config_dict.get('DataAPI', {}).get('access_log', 'False').upper() == 'TRUE'
+
         # Build the FastAPI app instance for this thread
         self.app = FastAPI(
             title='WeeWX API',
             summary='An API interface to WeeWX.',
             version='0.1.0',
+            default_response_class=ORJSONResponse,
             openapi_tags=[
                 {
                     'name': 'Database',
@@ -185,6 +188,10 @@ class ApiServerThread(threading.Thread):
             ]
         )
 
+        # Compress large responses for remote clients, over loopback compressing costs more than it saves
+        if self.host not in ('localhost', '127.0.0.1', '::1'):
+            self.app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
         # Add the data router to the server
         self.app.include_router(data_router(config_dict))
 
@@ -194,7 +201,11 @@ class ApiServerThread(threading.Thread):
             app=self.app,
             host=self.host,
             port=self.port,
-            log_level='info'
+            log_level='info',
+            # uvloop and httptools are picked up when installed, as they are with fastapi[standard]
+            loop='auto',
+            http='auto',
+            access_log=self.access_log
         )
         self._server = uvicorn.Server(config)
         self._server.run()